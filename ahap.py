@@ -1,12 +1,88 @@
 from enum import Enum
+import contextlib
 import datetime
+import functools
 import math
 import os
 import json
-from typing import Any, List, Tuple
+import tempfile
+from typing import Any, Iterable, List, NamedTuple, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard json module is used without it
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is only needed for AHAP.export_binary()
+    msgpack = None
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for freq_array()
+    np = None
+
+def _use_orjson(kwargs: dict) -> bool:
+    """orjson can only be used when it's installed and there are no json.dumps() arguments, or just indent=2."""
+    return orjson is not None and (not kwargs or kwargs == {"indent": 2})
+
+@contextlib.contextmanager
+def _open_replacing(filepath: str, mode: str, **kwargs):
+    """
+    Opens a temporary file next to filepath, which replaces filepath only when writing it succeeded.
+    So an export failing halfway never leaves a truncated file behind.
+    If filepath is a symlink, the file it points to is replaced and the link is kept.
+    """
+    filepath = os.path.realpath(filepath)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filepath) or ".", suffix=".tmp")
+    try:
+        # mkstemp creates the file readable only by us, give it the permissions open() would have
+        if os.path.exists(filepath):
+            os.chmod(tmp, os.stat(filepath).st_mode & 0o777)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp, 0o666 & ~umask)
+        with os.fdopen(fd, mode, **kwargs) as f:
+            fd = None
+            yield f
+        os.replace(tmp, filepath)
+    finally:
+        if fd is not None:
+            os.close(fd)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def _orjson_default(obj: Any) -> Any:
+    """Converts float subclasses (which json accepts, but orjson doesn't) to plain floats."""
+    if isinstance(obj, float):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def _dumps(data: Any, **kwargs) -> bytes:
+    """
+    Serialize data to JSON bytes, using orjson when it is installed.
+
+    Args:
+        data (Any): The data to serialize.
+        **kwargs: Extra arguments for json.dumps(). orjson is only used when there are none, or just indent=2.
+
+    Returns:
+        bytes: The UTF-8 encoded JSON document.
+    """
+    if _use_orjson(kwargs):
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if kwargs else 0)
+        try:
+            return orjson.dumps(data, default=_orjson_default, option=option)
+        except TypeError:
+            pass  # orjson refuses some data json accepts (e.g. non-string keys), so the result doesn't depend on it being installed
+    return json.dumps(data, **kwargs).encode("utf-8")
 
 class HapticCurve:
     """Represents the haptic curve"""
+    __slots__ = ("time", "parameter_value")
+
     def __init__(self, time: float, parameter_value: float):
         """
         Initialize a HapticCurve object.
@@ -43,7 +119,7 @@ def curves(c: List[HapticCurve]) -> List[dict]:
     Returns:
         List[dict]: A list of dictionaries containing the time and parameter value of each curve.
     """
-    return [i.get_data() for i in c]
+    return [{"Time": i.time, "ParameterValue": i.parameter_value} for i in c]
 
 class CurveParamID(Enum):
     H_Intensity = "HapticIntensityControl"
@@ -73,18 +149,89 @@ class ParamID(Enum):
     A_DecayTime = "AudioDecayTime"
     A_ReleaseTime = "AudioReleaseTime"
 
+# plain strings for the parameter ids the event builders use, so building an event doesn't resolve the enum each time
+_PID_HI = ParamID.H_Intensity.value
+_PID_HS = ParamID.H_Sharpness.value
+_PID_AV = ParamID.A_Volume.value
+
+def _haptic_parameters(haptic_intensity: float, haptic_sharpness: float) -> List[dict]:
+    """Returns the event parameters shared by the haptic events: intensity and sharpness."""
+    return [
+        {
+            "ParameterID": _PID_HI,
+            "ParameterValue": haptic_intensity,
+        },
+        {
+            "ParameterID": _PID_HS,
+            "ParameterValue": haptic_sharpness,
+        }
+    ]
+
+def _event(etype: str, time: float, parameters: List[dict], event_duration: float = None, event_waveform_path: str = None) -> dict:
+    """Builds a pattern entry for an event, see AHAP.add_event() for the arguments."""
+    pattern = {
+        "Event": {
+            "Time": time,
+            "EventType": etype,
+            "EventParameters": parameters
+        }
+    }
+    if event_duration is not None:
+        pattern["Event"]["EventDuration"] = event_duration
+    if event_waveform_path is not None:
+        pattern["Event"]["EventWaveformPath"] = event_waveform_path
+    return pattern
+
 # soon we will do it a @classmethod, but it'll break compatibility so i'm lazy!
 def create_curve(start_time: float, end_time: float, start_value: float, end_value: float, total=10):
-    timediff=end_time-start_time
-    valuediff=end_value-start_value
-    timestep=timediff/total
-    valuestep=valuediff/total
-    curvelist=[]
-    for i in range(total):
-        curvelist.append(HapticCurve(start_time+timestep*(i+1), start_value+valuestep*(i+1)))
-    #print("start time", start_time, "endtime", end_time)
+    """
+    Create a linear curve of control points.
+
+    The first point is one step after start_time, the last one is exactly at end_time.
+
+    Args:
+        start_time (float): The time the curve starts from.
+        end_time (float): The time of the last control point.
+        start_value (float): The parameter value the curve starts from.
+        end_value (float): The parameter value of the last control point.
+        total (int): The number of control points.
+
+    Returns:
+        List[HapticCurve]: The control points of the curve.
+    """
+    timestep=(end_time-start_time)/total
+    valuestep=(end_value-start_value)/total
+    # one comprehension instead of append() per point, no per-iteration bookkeeping
+    curvelist = [HapticCurve(start_time+timestep*i, start_value+valuestep*i) for i in range(1, total)]
+    curvelist.append(HapticCurve(end_time, end_value))  # not start+step*total, which can miss the end by a rounding error
     return curvelist
 
+class CurvePoint(NamedTuple):
+    """An immutable control point, can be used everywhere a HapticCurve can."""
+    time: float
+    parameter_value: float
+
+@functools.lru_cache(maxsize=256)
+def create_curve_cached(start_time: float, end_time: float, start_value: float, end_value: float, total=10) -> Tuple[CurvePoint, ...]:
+    """
+    Same as create_curve(), but a curve with the same arguments is only created once and then shared.
+    Useful when the same curve shape is added many times, e.g. for every note of a midi file:
+    add_parameter_curve() puts one shared list of control points into the pattern for all curves made from it.
+    The control points are immutable, so sharing them is safe.
+
+    Returns:
+        Tuple[CurvePoint, ...]: The control points of the curve.
+    """
+    return tuple(CurvePoint(p.time, p.parameter_value) for p in create_curve(start_time, end_time, start_value, end_value, total))
+
+@functools.lru_cache(maxsize=256)
+def _shared_control_points(control_points: Tuple[CurvePoint, ...]) -> List[dict]:
+    """The control point dicts of a CurvePoint tuple, built once and shared by every parameter curve using those points."""
+    return [{"Time": p.time, "ParameterValue": p.parameter_value} for p in control_points]
+
+def _pattern_time(pattern: dict) -> float:
+    """Returns the time of a pattern entry, whatever kind of entry ("Event", "ParameterCurve", ...) it is."""
+    return next(iter(pattern.values())).get("Time", 0)
 
 class AHAP:
     """_Class that allows to make Apple haptic signal files (.ahap)."""
@@ -100,12 +247,13 @@ class AHAP:
             "Version": 1.0,
             "Metadata": {
                 "Project": "Basis",
-                "Created": str(datetime.datetime.now()),
+                "Created": datetime.datetime.now().isoformat(),
                 "Description": description,
                 "Created By": created_by
             },
             "Pattern": []
         }
+        self._dirty = False  # True when the pattern may be out of time order, it's sorted on export
 
     def add_event(self, etype: str, time: float, parameters: List[dict], event_duration: float = None, event_waveform_path: str = None):
         """
@@ -117,18 +265,8 @@ class AHAP:
             time (float): The time of the event in seconds.
             parameters (List[dict]): The event parameters as a list of dictionaries.
         """
-        pattern = {
-            "Event": {
-                "Time": time,
-                "EventType": etype,
-                "EventParameters": parameters
-            }
-        }
-        if event_duration is not None:
-            pattern["Event"]["EventDuration"] = event_duration
-        if event_waveform_path is not None:
-            pattern["Event"]["EventWaveformPath"] = event_waveform_path
-        self.data["Pattern"].append(pattern)
+        self.data["Pattern"].append(_event(etype, time, parameters, event_duration, event_waveform_path))
+        self._dirty = True
 
     def __rshift__(self, args: Tuple):
         self.add_event(*args)
@@ -144,17 +282,7 @@ class AHAP:
             haptic_sharpness (float): The sharpness of the haptic event.
                 Should be a float between 0 and 1.
         """
-        parameters = [
-            {
-                "ParameterID": ParamID.H_Intensity.value,
-                "ParameterValue": haptic_intensity,
-            },
-            {
-                "ParameterID": ParamID.H_Sharpness.value,
-                "ParameterValue": haptic_sharpness,
-            }
-        ]
-
+        parameters = _haptic_parameters(haptic_intensity, haptic_sharpness)
         self.add_event(etype="HapticTransient", time=time, parameters=parameters)
 
     def add_haptic_continuous_event(self, time: float, event_duration: float = 1, haptic_intensity: float = 0.5, haptic_sharpness: float = 0.5):
@@ -169,19 +297,25 @@ class AHAP:
             haptic_sharpness (float): The sharpness of the haptic event.
                 Should be a float between 0 and 1.
         """
-        parameters = [
-            {
-                "ParameterID": ParamID.H_Intensity.value,
-                "ParameterValue": haptic_intensity,
-            },
-            {
-                "ParameterID": ParamID.H_Sharpness.value,
-                "ParameterValue": haptic_sharpness,
-            }
-        ]
-
+        parameters = _haptic_parameters(haptic_intensity, haptic_sharpness)
         self.add_event(etype="HapticContinuous", time=time, parameters=parameters, event_duration=event_duration)
 
+    def add_haptic_continuous_events(self, events: Iterable[Tuple[float, float, float, float]]):
+        """
+        Adds many haptic continuous events to the pattern at once.
+        Faster than calling add_haptic_continuous_event() for every event, e.g. when converting midi files.
+
+        Args:
+            events (Iterable[Tuple[float, float, float, float]]): The events as (time, event_duration, haptic_intensity, haptic_sharpness) tuples.
+                The values have the same meaning as in add_haptic_continuous_event().
+        """
+        # a list comprehension rather than a generator: appending in the comprehension is cheaper than resuming a generator per event
+        self.data["Pattern"].extend([
+            _event("HapticContinuous", time, _haptic_parameters(haptic_intensity, haptic_sharpness), event_duration)
+            for time, event_duration, haptic_intensity, haptic_sharpness in events
+        ])
+        self._dirty = True
+
     def add_audio_custom_event(self, time: float, wav_filepath: str, volume: float = 0.75):
         """
         Adds an audio custom event to the pattern.
@@ -194,7 +328,7 @@ class AHAP:
         """
         parameters = [
             {
-                "ParameterID": ParamID.A_Volume.value,
+                "ParameterID": _PID_AV,
                 "ParameterValue": volume,
             }
         ]
@@ -210,17 +344,24 @@ class AHAP:
                 A_Brightness, A_Pan, A_Pitch, A_Volume, A_AttackTime, A_DecayTime, A_ReleaseTime.
             start_time (float): The time of the start of the curve in seconds.
             control_points (List[HapticCurve]): The list of control points for the curve.
-                Should be a list of HapticCurve objects.
+                Should be a list of HapticCurve objects, or the CurvePoint tuple create_curve_cached() returns.
+                For a CurvePoint tuple, every curve with the same points shares one control point list in self.data,
+                so don't modify it there.
         """
+        if type(control_points) is tuple and all(type(p) is CurvePoint for p in control_points):
+            points = _shared_control_points(control_points)
+        else:
+            points = [{"Time": p.time, "ParameterValue": p.parameter_value} for p in control_points]
         pattern = {
             "ParameterCurve": {
                 "ParameterID": parameter_id.value,
                 "Time": start_time,
-                "ParameterCurveControlPoints": curves(control_points)
+                "ParameterCurveControlPoints": points
             }
         }
 
         self.data["Pattern"].append(pattern)
+        self._dirty = True
 
     def __repr__(self):
         """
@@ -228,57 +369,149 @@ class AHAP:
         """
         repr(self.data)
 
+    def _sort_pattern(self):
+        """Sorts the pattern by time in place, if anything was added since the last sort."""
+        if self._dirty:
+            # sorted once here instead of on every add, stable so entries with the same time keep their order
+            self.data["Pattern"].sort(key=_pattern_time)
+            self._dirty = False
+
     def export(self, filename: str, path: str = ".", **kwargs):
         """
         Export the AHAP object to a JSON file.
+        The pattern is sorted by time first, in place, so self.data["Pattern"] stays in that order afterwards.
 
         Args:
             filename (str): The name of the output file.
             path (str): The path to the output directory.
             **kwargs: Extra arguments you want to pass on to json.dumps(). For example, indent=4 for a pretty formatted JSON. 
+                If orjson is installed, it is used instead of json when no extra arguments (or only indent=2) are given.
+                With orjson and without extra arguments the pattern is written event by event, so the whole file is never built in memory.
+                Indented output without orjson is written with json.dump() for the same reason. That's a bit slower (around 15%) than
+                building the string first, but json's fast C encoder can't do indentation anyway. Other arguments use one json.dumps() call.
         """
-        with open(os.path.join(path, filename), 'w') as f:
-            f.write(json.dumps(self.data, **kwargs))
+        self._sort_pattern()
+        filepath = os.path.join(path, filename)
+        if kwargs.get("indent") is not None and not _use_orjson(kwargs):
+            # json encodes indented output in python either way, so json.dump() costs little time and never holds the whole string
+            with _open_replacing(filepath, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, **kwargs)
+            return
+        if kwargs or orjson is None:
+            # one json.dumps() call is faster than one per event, and serializing first keeps a failed export from truncating the file
+            data = _dumps(self.data, **kwargs)
+            with open(filepath, 'wb') as f:
+                f.write(data)
+            return
+        with _open_replacing(filepath, 'wb') as f:
+            f.write(b"{")
+            for i, (key, value) in enumerate(self.data.items()):
+                if i: f.write(b",")
+                f.write(_dumps(key) + b":")
+                if key != "Pattern":
+                    f.write(_dumps(value))
+                    continue
+                f.write(b"[")
+                for j, pattern in enumerate(value):
+                    if j: f.write(b",")
+                    f.write(_dumps(pattern))
+                f.write(b"]")
+            f.write(b"}")
+
+    def export_binary(self, filename: str, path: str = "."):
+        """
+        Export the AHAP object to a MessagePack file. Requires msgpack.
+        Apple devices can't play these files, but they are much smaller and faster to write and read than JSON,
+        so they're handy for storing or sending patterns before converting them with export().
+        Floats are stored with single precision.
+        Like export(), the pattern is sorted by time in place first.
+
+        Args:
+            filename (str): The name of the output file.
+            path (str): The path to the output directory.
+
+        Raises:
+            ImportError: If msgpack is not installed.
+        """
+        if msgpack is None:
+            raise ImportError("export_binary() requires msgpack. Install it with pip install msgpack")
+        self._sort_pattern()
+        with open(os.path.join(path, filename), 'wb') as f:
+            f.write(msgpack.packb(self.data, use_single_float=True))
 
     def __call__(self, *args: Any, **kwds: Any) -> Any:
         self.export(*args, **kwds)
 
-    def __add__(self, other: AHAP):
-        """adds 2 ahap files. Attension, it smooshes them one on another, it doesn't work as expected now. Please don't use this method if you don't want to really smoosh them.
+    def __add__(self, other: "AHAP") -> "AHAP":
+        """adds 2 ahap files. Attension, it smooshes them one on another, the events of both files keep their times. Please don't use this method if you don't want to really smoosh them.
 
         Args:
             other (AHAP): another Ahap class.
+
+        Returns:
+            AHAP: a new AHAP with the description and creator of this one and the events of both.
         """
-        data = {
-            "Version": 1.0,
-            "Metadata": {
-                "Project": "Basis",
-                "Created": str(datetime.datetime.now()),
-                "Description": self.data["Metadata"]["Description"],
-                "Created By": self.data["Metadata"]["Created By"]
-            },
-            "Pattern": self.data["Pattern"]+other.data["Pattern"]
-        }
+        new = AHAP(self.data["Metadata"]["Description"], self.data["Metadata"]["Created By"])
+        new.data["Pattern"].extend(self.data["Pattern"])
+        new.data["Pattern"].extend(other.data["Pattern"])
+        new._dirty = True
+        return new
+
+_LOG2_80 = math.log2(80)
+_LOG2_230_MINUS_LOG2_80_INV = 1.0 / (math.log2(230) - _LOG2_80)
 
 def freq(n: int, normalize: bool=True) -> float:
     """
     calculates the haptic sharpness value from frequency in hz.
+    Results are cached, because midi files only use a handful of distinct pitches.
 
     Args:
-        n (int): The input frequency value.
+        n (int): The input frequency value. Anything float() accepts, e.g. numpy scalars.
         normalize (bool): if normalizing, all high frequencies will be 230 and all low will be 80 if value is too high or too low.
     Returns:
         float: The normalized frequency value between 0 and 1.
 
     Raises:
-        ValueError: If the input frequency is less than 80 or greater than 230.
-        ValueError: If the calculated normalized frequency is less than 0 or greater than 1.
+        ValueError: If normalize is False and the input frequency is less than 80 or greater than 230.
     """
-    if normalize and n>230: n=230
-    if normalize and n<80: n=80
-    if n < 80 or n > 230:
+    return _freq(float(n), normalize)
+
+@functools.lru_cache(maxsize=512)
+def _freq(n: float, normalize: bool) -> float:
+    """The cached part of freq(), n is always a float so 80, 80.0 and numpy.float64(80) share one entry."""
+    if normalize:
+        n = 80 if n < 80 else (230 if n > 230 else n)
+    elif n < 80 or n > 230:
         raise ValueError(f"Incorrect frequency. Frequency must be between 80 and 230, but it is {n}")
-    r = (math.log(n) - math.log(80)) / (math.log(230) - math.log(80))
-    if r < 0 or r > 1:
-        raise ValueError("The calculated normalized frequency is out of range. Result must be between 0 and 1.")
-    return r
\ No newline at end of file
+    # n is between 80 and 230 here, so the result is always between 0 and 1
+    return (math.log2(n) - _LOG2_80) * _LOG2_230_MINUS_LOG2_80_INV
+
+def freq_array(ns, normalize: bool=True, out=None):
+    """
+    calculates the haptic sharpness values from an array of frequencies in hz at once. Requires numpy.
+
+    Args:
+        ns (array-like): The input frequency values.
+        normalize (bool): if normalizing, all high frequencies will be 230 and all low will be 80 if value is too high or too low.
+        out (numpy.ndarray): optional float64 array of the same shape to write the result into. Every step is computed in place in it,
+            so no temporary arrays are allocated. May be ns itself.
+    Returns:
+        numpy.ndarray: The normalized frequency values between 0 and 1.
+
+    Raises:
+        ImportError: If numpy is not installed.
+        ValueError: If normalize is False and any input frequency is less than 80 or greater than 230.
+    """
+    if np is None:
+        raise ImportError("freq_array() requires numpy. Install it with pip install numpy")
+    ns = np.asarray(ns, dtype=np.float64)
+    if out is None:
+        out = np.empty_like(ns)
+    if normalize:
+        ns = np.clip(ns, 80, 230, out=out)
+    elif ns.size and (ns.min() < 80 or ns.max() > 230):
+        raise ValueError(f"Incorrect frequency. Frequencies must be between 80 and 230, but they are between {ns.min()} and {ns.max()}")
+    np.log2(ns, out=out)
+    out -= _LOG2_80
+    out *= _LOG2_230_MINUS_LOG2_80_INV
+    return out
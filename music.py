@@ -1,12 +1,16 @@
 from librosa import midi_to_hz as note
-from ahap import AHAP, freq
+from ahap import AHAP, freq_array
+from itertools import repeat
+import numpy as np
 import mido
+import os
 import sys
 
 
 # Step 1: Define initial variables
 time = 0.0
 duration = 0.0
+NOTE_TYPES = frozenset(('note_on', 'note_off'))
 
 # Step 2: Read the MIDI file (obtain the filename from command line argument)
 if len(sys.argv) < 2:
@@ -19,23 +23,33 @@ ahap = AHAP(f"midi file {filename}", "midi to haptic generator")
 
 # Step 3: Convert notes to haptics
 note_state = {}  # Dictionary to track note states (on/off)
+starts = []  # start time, duration and midi note of every finished note
+durations = []
+notes = []
 for msg in midi_file:
     time += msg.time
-    if msg.is_meta and hasattr(msg, "note"): continue
+    if msg.type not in NOTE_TYPES: continue  # meta, control change and other messages carry no notes
     if msg.type == 'note_on' and msg.velocity>0:
         note_state[msg.note] = time
     elif msg.type == 'note_off' or (msg.type=='note_on' and msg.velocity==0):  # musescore doesn't do note_off, it does note on with velocity 0.
-        if msg.note not in note_state:
+        start = note_state.pop(msg.note, None)  # the note is finished, forget it
+        if start is None:
             print(f"Warning: Found note_off message without a corresponding note_on for note {msg.note}")
         else:
-            duration = time - note_state[msg.note]
+            duration = time - start
             #print(duration)
-            # Add a haptic event for the note
-            ahap.add_haptic_continuous_event(note_state[msg.note], duration, 1.0, freq(note(msg.note)))
+            starts.append(start)
+            durations.append(duration)
+            notes.append(msg.note)
+
+# Add a haptic event for every note, sharpnesses are converted all at once
+hz = note(np.array(notes, dtype=np.float64))
+sharpnesses = freq_array(hz, out=hz).tolist()
+ahap.add_haptic_continuous_events(zip(starts, durations, repeat(1.0), sharpnesses))
 
 
 # Step 4: Export the haptics to an AHAP file
-output_filename = sys.argv[1].split('.')[0] + '.ahap'
+output_filename = os.path.splitext(sys.argv[1])[0] + '.ahap'
 ahap.export(output_filename)
 
 # Finished! You've converted the MIDI file to haptics and saved it as '[filename].ahap'
@@ -1,5 +1,10 @@
+import json
+import os
+import tempfile
 import unittest
-from ahap import freq
+from unittest import mock
+import ahap
+from ahap import AHAP, CurveParamID, freq, freq_array, create_curve, create_curve_cached
 
 class TestFreq(unittest.TestCase):
     #def setUp(self) -> None:
@@ -11,10 +16,169 @@ class TestFreq(unittest.TestCase):
             except Exception as e:
                 self.fail(f'the {i} hz freq not converted., exception: {e}')
 
+    def test_normalize(self):
+        self.assertEqual(freq(50), 0.0)
+        self.assertEqual(freq(80), 0.0)
+        self.assertAlmostEqual(freq(230), 1.0)
+        self.assertAlmostEqual(freq(1000), 1.0)
+
+    def test_freq_cache(self):
+        ahap._freq.cache_clear()
+        self.assertEqual(freq(100), freq(100.0))
+        self.assertEqual(ahap._freq.cache_info().currsize, 1)
+
+    @unittest.skipIf(ahap.np is None, "numpy is not installed")
+    def test_freq_numpy(self):
+        self.assertAlmostEqual(freq(ahap.np.array(100.0)), freq(100))
+        self.assertAlmostEqual(freq(ahap.np.float64(100.0)), freq(100))
+
     def test_raisefreq(self):
         with self.assertRaises(ValueError):
             freq(79, False)
             freq(231, False)
 
+    @unittest.skipIf(ahap.np is None, "numpy is not installed")
+    def test_freq_array(self):
+        hz = [50, 80, 120.5, 230, 400]
+        expected = [freq(i) for i in hz]
+        for got, want in zip(freq_array(hz), expected):
+            self.assertAlmostEqual(got, want)
+        with self.assertRaises(ValueError):
+            freq_array(hz, False)
+        out = ahap.np.array(hz, dtype=float)
+        self.assertIs(freq_array(out, out=out), out)
+        for got, want in zip(out, expected):
+            self.assertAlmostEqual(got, want)
+
+class TestCurve(unittest.TestCase):
+    def test_create_curve(self):
+        c = create_curve(0.0, 1.0, 0.4, 0.8, 4)
+        self.assertEqual(len(c), 4)
+        self.assertAlmostEqual(c[0].time, 0.25)
+        self.assertAlmostEqual(c[0].parameter_value, 0.5)
+        self.assertAlmostEqual(c[-1].time, 1.0)
+        self.assertAlmostEqual(c[-1].parameter_value, 0.8)
+        c = create_curve(0.2, 0.9, 0.0, 1.0, 10)
+        self.assertEqual((c[-1].time, c[-1].parameter_value), (0.9, 1.0))
+
+    def test_create_curve_cached(self):
+        c = create_curve_cached(0.0, 1.0, 0.4, 0.8, 4)
+        self.assertIs(create_curve_cached(0.0, 1.0, 0.4, 0.8, 4), c)
+        self.assertEqual([(p.time, p.parameter_value) for p in c],
+                         [(p.time, p.parameter_value) for p in create_curve(0.0, 1.0, 0.4, 0.8, 4)])
+        with self.assertRaises(AttributeError):
+            c[0].time = 99
+        self.assertEqual(create_curve_cached(0.0, 1.0, 0.4, 0.8, 4)[0].time, 0.25)
+        a = AHAP()
+        a.add_parameter_curve(CurveParamID.H_Sharpness, 0.0, c)
+        a.add_parameter_curve(CurveParamID.H_Intensity, 2.0, create_curve_cached(0.0, 1.0, 0.4, 0.8, 4))
+        a.add_parameter_curve(CurveParamID.H_Intensity, 4.0, create_curve(0.0, 1.0, 0.4, 0.8, 4))
+        first, second, uncached = (p["ParameterCurve"]["ParameterCurveControlPoints"] for p in a.data["Pattern"])
+        self.assertEqual(first[-1], {"Time": 1.0, "ParameterValue": 0.8})
+        self.assertIs(first, second)
+        self.assertIsNot(first, uncached)
+        self.assertEqual(first, uncached)
+
+class TestAHAP(unittest.TestCase):
+    def test_add_haptic_continuous_events(self):
+        one_by_one = AHAP()
+        one_by_one.add_haptic_continuous_event(0.0, 0.5, 1.0, 0.2)
+        one_by_one.add_haptic_continuous_event(0.5, 0.25, 0.8, 0.9)
+        batch = AHAP()
+        batch.add_haptic_continuous_events([(0.0, 0.5, 1.0, 0.2), (0.5, 0.25, 0.8, 0.9)])
+        self.assertEqual(batch.data["Pattern"], one_by_one.data["Pattern"])
+
+    def test_export_float_subclass(self):
+        class F(float):
+            pass
+        a = AHAP()
+        a.add_haptic_transient_event(F(0.25), F(1.0), F(0.5))
+        a.data["Metadata"][1] = "non-string key"  # json accepts it, orjson doesn't
+        with tempfile.TemporaryDirectory() as d:
+            a.export("test.ahap", d)
+            with open(os.path.join(d, "test.ahap")) as f:
+                event = json.load(f)["Pattern"][0]["Event"]
+        self.assertEqual(event["Time"], 0.25)
+        self.assertEqual([p["ParameterValue"] for p in event["EventParameters"]], [1.0, 0.5])
+
+    def test_export_keeps_symlink_and_tmp_files(self):
+        a = AHAP()
+        a.add_haptic_transient_event(0.0)
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, "real.ahap"), "w") as f:
+                f.write("old")
+            with open(os.path.join(d, "link.ahap.tmp"), "w") as f:
+                f.write("unrelated")
+            os.symlink("real.ahap", os.path.join(d, "link.ahap"))
+            a.export("link.ahap", d)
+            self.assertTrue(os.path.islink(os.path.join(d, "link.ahap")))
+            with open(os.path.join(d, "real.ahap")) as f:
+                self.assertEqual(json.load(f), a.data)
+            with open(os.path.join(d, "link.ahap.tmp")) as f:
+                self.assertEqual(f.read(), "unrelated")
+            self.assertEqual(sorted(os.listdir(d)), ["link.ahap", "link.ahap.tmp", "real.ahap"])
+
+    def test_add(self):
+        a = AHAP("first", "tester")
+        a.add_haptic_transient_event(0.0)
+        b = AHAP("second", "someone else")
+        b.add_haptic_continuous_event(0.5)
+        c = a + b
+        self.assertIsInstance(c, AHAP)
+        self.assertEqual(c.data["Metadata"]["Description"], "first")
+        self.assertEqual(c.data["Metadata"]["Created By"], "tester")
+        self.assertEqual(c.data["Pattern"], a.data["Pattern"] + b.data["Pattern"])
+        self.assertEqual(len(a.data["Pattern"]), 1)
+
+    def test_export(self):
+        a = AHAP()
+        a.add_haptic_transient_event(0.0, 1.0, 0.5)
+        a.add_parameter_curve(CurveParamID.H_Sharpness, 0.0, create_curve(0.0, 1.0, 0.2, 0.8, 5))
+        a.add_haptic_continuous_event(0.5, 1.0, 0.8, 0.4)
+        for orjson in (ahap.orjson, None):
+            for kwargs in ({}, {"indent": 2}, {"indent": 4}, {"sort_keys": True}):
+                with mock.patch.object(ahap, "orjson", orjson), tempfile.TemporaryDirectory() as d:
+                    a.export("test.ahap", d, **kwargs)
+                    with open(os.path.join(d, "test.ahap")) as f:
+                        self.assertEqual(json.load(f), a.data)
+
+    def test_failed_export_keeps_file(self):
+        a = AHAP()
+        a.add_haptic_transient_event(0.0)
+        for orjson in (ahap.orjson, None):
+            with mock.patch.object(ahap, "orjson", orjson), tempfile.TemporaryDirectory() as d:
+                a.export("test.ahap", d)
+                a.add_haptic_transient_event(0.5, object())
+                with self.assertRaises(TypeError):
+                    a.export("test.ahap", d)
+                self.assertEqual(os.listdir(d), ["test.ahap"])
+                with open(os.path.join(d, "test.ahap")) as f:
+                    self.assertEqual(len(json.load(f)["Pattern"]), 1)
+                a.data["Pattern"].pop()
+
+    @unittest.skipIf(ahap.msgpack is None, "msgpack is not installed")
+    def test_export_binary(self):
+        a = AHAP()
+        a.add_haptic_transient_event(0.5, 1.0, 0.5)
+        a.add_haptic_transient_event(0.0, 1.0, 0.5)
+        with tempfile.TemporaryDirectory() as d:
+            a.export_binary("test.ahap.msgpack", d)
+            with open(os.path.join(d, "test.ahap.msgpack"), "rb") as f:
+                self.assertEqual(ahap.msgpack.unpackb(f.read()), a.data)
+        self.assertEqual([p["Event"]["Time"] for p in a.data["Pattern"]], [0.0, 0.5])
+
+    def test_export_sorts_by_time(self):
+        a = AHAP()
+        a.add_haptic_continuous_event(1.0)
+        a.add_parameter_curve(CurveParamID.H_Sharpness, 0.5, create_curve(0.0, 1.0, 0.2, 0.8, 5))
+        a.add_haptic_transient_event(0.0)
+        a.add_haptic_transient_event(0.5)
+        with tempfile.TemporaryDirectory() as d:
+            a.export("test.ahap", d)
+            with open(os.path.join(d, "test.ahap")) as f:
+                pattern = json.load(f)["Pattern"]
+        self.assertEqual([next(iter(p.values()))["Time"] for p in pattern], [0.0, 0.5, 0.5, 1.0])
+        self.assertIn("ParameterCurve", pattern[1])
+
 if __name__=="__main__":
     unittest.main()
\ No newline at end of file